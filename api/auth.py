@@ -1,9 +1,18 @@
 # api/auth.py
-import base64, json, os
+import functools, os
 from typing import Optional, List
 from fastapi import Request, HTTPException, Header
 from pydantic import BaseModel
 
+import orjson
+
+# pybase64 decodes with SIMD (AVX2/AVX-512, auto-dispatched at import) — a big
+# win for multi-KB principals carrying group claims. Optional; stdlib fallback.
+try:
+    from pybase64 import b64decode as _b64decode
+except ImportError:
+    from base64 import b64decode as _b64decode
+
 # -------------------------------------------------------------------
 # Config
 # -------------------------------------------------------------------
@@ -25,8 +34,11 @@ class UserPrincipal(BaseModel):
     job_title: Optional[str] = None
     extension_grade: Optional[str] = None
 
-    @property
+    @functools.cached_property
     def grade(self) -> Optional[str]:
+        # Derived once per instance instead of on every access — principals are
+        # reused across requests via the parse cache, so the role walk and the
+        # per-role .lower() happen a single time.
         # 1) explicit extension
         if self.extension_grade:
             return self.extension_grade
@@ -46,9 +58,30 @@ class UserPrincipal(BaseModel):
 # -------------------------------------------------------------------
 # Helpers
 # -------------------------------------------------------------------
+# Claim keys probed per principal, hoisted so each request does a single
+# `in`-check pass instead of re-building chained .get(...) fallbacks.
+_NAME_KEYS = ("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/name", "name")
+_OID_KEYS = (
+    "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/nameidentifier",
+    "oid",
+    "objectidentifier",
+)
+_UPN_KEYS = (
+    "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/upn",
+    "upn",
+    "preferred_username",
+)
+_GRADE_KEYS = (
+    # custom extension examples (adjust to your tenant's schema names)
+    "extension_userGrade", "extension_usergrade", "ext_userGrade", "ext_grade",
+    # AAD jobTitle may appear as short 'jobtitle' or URI form
+    "jobTitle", "jobtitle", "http://schemas.microsoft.com/identity/claims/jobtitle",
+)
+
 def _b64_json(s: str) -> dict:
     try:
-        return json.loads(base64.b64decode(s).decode("utf-8")) or {}
+        # orjson parses the decoded bytes directly (no utf-8 decode step)
+        return orjson.loads(_b64decode(s)) or {}
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid principal header: {e}")
 
@@ -73,26 +106,63 @@ def _extract_grade_from_claims(claims: dict) -> Optional[str]:
     """
     Best-effort grade extraction from various possible claim keys.
     """
-    # custom extension examples (adjust to your tenant’s schema names)
-    for k in ("extension_userGrade", "extension_usergrade", "ext_userGrade", "ext_grade"):
-        if k in claims:
-            return claims[k]
-    # AAD jobTitle may appear as short 'jobtitle' or URI form
-    for k in ("jobTitle", "jobtitle", "http://schemas.microsoft.com/identity/claims/jobtitle"):
-        if k in claims:
-            return claims[k]
-    return None
+    return next((claims[k] for k in _GRADE_KEYS if k in claims), None)
+
+@functools.lru_cache(maxsize=4096)
+def _parse_principal(hdr: str) -> UserPrincipal:
+    """
+    Decode + parse an Easy Auth principal header into a UserPrincipal.
+
+    The same session cookie carries an identical base64 blob on every request,
+    so this is a pure function of the header string — memoize it and repeat
+    requests collapse to a dict lookup. lru_cache does not cache exceptions,
+    which is exactly what we want: invalid headers re-raise 401 each time.
+    """
+    raw = _b64_json(hdr)
+    claims = _claim_map(raw.get("claims", []))
+
+    name = next((claims[k] for k in _NAME_KEYS if k in claims), None)
+    oid = next((claims[k] for k in _OID_KEYS if k in claims), None)
+    upn = next((claims[k] for k in _UPN_KEYS if k in claims), None)
+
+    if not oid:
+        raise HTTPException(status_code=401, detail="Missing oid claim.")
+
+    # roles: EasyAuth often puts them in userRoles (array) on root
+    roles_raw = raw.get("userRoles") or []
+    if isinstance(roles_raw, str):
+        roles_raw = [roles_raw]
+
+    # groups may be present (optional)
+    groups = raw.get("groups") or []
+
+    # grade from custom extensions or jobTitle
+    ext_grade = _extract_grade_from_claims(claims)
+
+    return UserPrincipal(
+        oid=oid,
+        name=name,
+        upn=upn,
+        roles=roles_raw,
+        groups=groups,
+        job_title=ext_grade,           # keep also in job_title for your .grade fallback
+        extension_grade=ext_grade
+    )
 
 # -------------------------------------------------------------------
 # Modes
 # -------------------------------------------------------------------
-def require_user(
+async def require_user(
     request: Request,
     x_api_key: Optional[str] = Header(None),
 ) -> UserPrincipal:
     """
     Returns a UserPrincipal or raises HTTPException(401).
     Behavior controlled by AUTH_MODE env var.
+
+    Async on purpose: everything here is in-memory (header reads + cached
+    principal parse), so running it on the event loop avoids FastAPI
+    dispatching the dependency to a threadpool worker per request.
     """
     mode = AUTH_MODE
 
@@ -136,47 +206,7 @@ def require_user(
         if not hdr:
             raise HTTPException(status_code=401, detail="No principal header (Easy Auth off?).")
 
-        raw = _b64_json(hdr)
-        claims = _claim_map(raw.get("claims", []))
-
-        name = (
-            claims.get("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/name")
-            or claims.get("name")
-        )
-        oid = (
-            claims.get("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/nameidentifier")
-            or claims.get("oid")
-            or claims.get("objectidentifier")
-        )
-        upn = (
-            claims.get("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/upn")
-            or claims.get("upn")
-            or claims.get("preferred_username")
-        )
-
-        if not oid:
-            raise HTTPException(status_code=401, detail="Missing oid claim.")
-
-        # roles: EasyAuth often puts them in userRoles (array) on root
-        roles_raw = raw.get("userRoles") or []
-        if isinstance(roles_raw, str):
-            roles_raw = [roles_raw]
-
-        # groups may be present (optional)
-        groups = raw.get("groups") or []
-
-        # grade from custom extensions or jobTitle
-        ext_grade = _extract_grade_from_claims(claims)
-
-        return UserPrincipal(
-            oid=oid,
-            name=name,
-            upn=upn,
-            roles=roles_raw,
-            groups=groups,
-            job_title=ext_grade,           # keep also in job_title for your .grade fallback
-            extension_grade=ext_grade
-        )
+        return _parse_principal(hdr)
 
     # Unknown mode
     raise HTTPException(status_code=401, detail=f"Unsupported AUTH_MODE '{mode}'")
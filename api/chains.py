@@ -1,45 +1,95 @@
-import os
-from typing import Any
-from openai import AzureOpenAI
-
-class MockResponse:
-    def __init__(self, content: str):
-        self.content = content
-
-class MockLLM:
-    def invoke(self, messages: Any) -> MockResponse:
-        # messages is a list of {role, content}; return a deterministic reply
-        user = [m for m in messages if m.get("role") == "user"][-1]["content"]
-        return MockResponse(f"[MOCK ANSWER] {user}")
-
-class AOAIChatClient:
-    """Mimics LangChain's .invoke(messages) interface."""
-    def __init__(self):
-        self.client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),        # <-- your AOAI key
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"), # e.g. https://<name>.openai.azure.com/
-            timeout=60,
-        )
-        # In Azure, 'model' is your DEPLOYMENT name (e.g. 'gpt4omini')
-        self.deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-
-    def invoke(self, messages, temperature=0.2):
-        # messages = [{"role":"system","content":"..."}, {"role":"user","content":"..."}]
-        resp = self.client.chat.completions.create(
-            model=self.deployment,             # <-- deployment name here
-            messages=messages,
-            temperature=temperature,
-        )
-        return resp.choices[0].message  # has .content
-        
-def get_llm():
-    mode = os.getenv("CHAIN_MODE", "azure")
-    if mode == "offline":
-        return MockLLM()
-    else:
-        return AOAIChatClient()
-
-
-
-
+import functools
+import os
+from typing import Any
+from openai import AzureOpenAI, AsyncAzureOpenAI
+
+class MockResponse:
+    def __init__(self, content: str):
+        self.content = content
+
+class MockLLM:
+    def invoke(self, messages: Any, response_format: Any = None) -> MockResponse:
+        # messages is a list of {role, content}; return a deterministic reply
+        user = [m for m in messages if m.get("role") == "user"][-1]["content"]
+        return MockResponse(f"[MOCK ANSWER] {user}")
+
+    async def ainvoke(self, messages: Any, response_format: Any = None) -> MockResponse:
+        # async twin so async routes can `await llm.ainvoke(...)` in offline mode
+        return self.invoke(messages)
+
+    async def astream(self, messages: Any):
+        # yield the mock answer in a few pieces so streaming routes are testable offline
+        content = self.invoke(messages).content
+        for i in range(0, len(content), 16):
+            yield content[i:i + 16]
+
+class AOAIChatClient:
+    """Mimics LangChain's .invoke(messages) / .ainvoke(messages) interface."""
+    def __init__(self):
+        self.client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),        # <-- your AOAI key
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"), # e.g. https://<name>.openai.azure.com/
+            timeout=60,
+        )
+        # Async twin sharing the same config; used by the async routes so the
+        # event loop is never blocked on an AOAI round-trip.
+        self.aclient = AsyncAzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            timeout=60,
+        )
+        # In Azure, 'model' is your DEPLOYMENT name (e.g. 'gpt4omini')
+        self.deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+
+    def invoke(self, messages, temperature=0.2, response_format=None):
+        # messages = [{"role":"system","content":"..."}, {"role":"user","content":"..."}]
+        # response_format={"type": "json_object"} turns on JSON mode for
+        # callers that must get parseable output (e.g. the judge).
+        kwargs = {"response_format": response_format} if response_format else {}
+        resp = self.client.chat.completions.create(
+            model=self.deployment,             # <-- deployment name here
+            messages=messages,
+            temperature=temperature,
+            **kwargs,
+        )
+        return resp.choices[0].message  # has .content
+
+    async def ainvoke(self, messages, temperature=0.2, response_format=None):
+        kwargs = {"response_format": response_format} if response_format else {}
+        resp = await self.aclient.chat.completions.create(
+            model=self.deployment,
+            messages=messages,
+            temperature=temperature,
+            **kwargs,
+        )
+        return resp.choices[0].message
+
+    async def astream(self, messages, temperature=0.2):
+        # Token generator for streaming routes; yields content deltas as they
+        # arrive so the caller can flush them to the client immediately.
+        stream = await self.aclient.chat.completions.create(
+            model=self.deployment,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+        )
+        async for part in stream:
+            if part.choices and part.choices[0].delta and part.choices[0].delta.content:
+                yield part.choices[0].delta.content
+        
+@functools.lru_cache(maxsize=1)
+def get_llm():
+    # Memoized: building AOAIChatClient re-reads env vars and opens a fresh
+    # TCP+TLS pool; one client per process lets connections be reused across
+    # every /ask instead of handshaking each request.
+    mode = os.getenv("CHAIN_MODE", "azure")
+    if mode == "offline":
+        return MockLLM()
+    else:
+        return AOAIChatClient()
+
+
+
+
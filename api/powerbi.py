@@ -1,40 +1,74 @@
-import os, time, json, requests
-from typing import Dict, Any
-
-TENANT = os.getenv("PBI_TENANT_ID", "")
-CLIENT_ID = os.getenv("PBI_CLIENT_ID", "")
-CLIENT_SECRET = os.getenv("PBI_CLIENT_SECRET", "")
-SCOPE = "https://analysis.windows.net/powerbi/api/.default"
-AUTH_URL=lambda f"https://login.microsoftonline.com/{TENANT}/oauth2/v2.0/token"
-GROUP_ID = os.getenv("PBI_GROUP_ID", "")
-DATASET_ID = os.getenv("PBI_DATASET_ID", "")
-TABLE = os.getenv("PBI_TABLE", "attestations")
-
-_session = requests.Session()
-_token_cache = Dict[str, Any] = {"expires_at": 0, "access_token": None}
-
-def _get_token() -> str:
-    if not TENANT or not CLIENT_ID or not CLIENT_SECRET:
-        raise RuntimeError("Power BI not configured")
-    now = time.time()
-    if _token_cache["access_token"] and now < _token_cache["expires"] - 60:
-        return _token_cache["access_token"]
-    r = _session.post(AUTH_URL(), data={
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "grant_type": "client_credentials",
-        "scope": SCOPE,
-    }, timeout=20)
-    
-    r.raise_for_status(); tok = r.json()
-    _token_cache.update({"access_token": tok["access_token"], "expires": now + int(tok.get("expires_in", 3599))})
-    return _token_cache["access_token"]
-
-def push_rows(rows):
-    token = _get_token()
-    url = f"https://api.powerbi.com/v1.0/myorg/groups/{GROUP_ID}/datasets/{DATASET_ID}/tables/{TABLE}/rows"
-    hdrs = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    r = _session.post(url, headers=hdrs, data=json.dumps({"rows": rows}), timeout=20)
-    r.raise_for_status(); return True
-
-
+import asyncio
+import os, time
+from typing import Any, Dict, Optional
+
+import httpx
+import orjson
+
+TENANT = os.getenv("PBI_TENANT_ID", "")
+CLIENT_ID = os.getenv("PBI_CLIENT_ID", "")
+CLIENT_SECRET = os.getenv("PBI_CLIENT_SECRET", "")
+SCOPE = "https://analysis.windows.net/powerbi/api/.default"
+GROUP_ID = os.getenv("PBI_GROUP_ID", "")
+DATASET_ID = os.getenv("PBI_DATASET_ID", "")
+TABLE = os.getenv("PBI_TABLE", "attestations")
+
+def _auth_url() -> str:
+    return f"https://login.microsoftonline.com/{TENANT}/oauth2/v2.0/token"
+
+# One pooled async client per process: per-call requests sessions renegotiated
+# TCP+TLS on every push and blocked a worker thread. Lazily built so importing
+# this module stays cheap.
+_client: Optional[httpx.AsyncClient] = None
+_token_cache: Dict[str, Any] = {"expires_at": 0.0, "access_token": None}
+# Single in-flight refresh: without this, every request that hits expiry at
+# the same moment fires its own client_credentials grant at Entra.
+_token_lock = asyncio.Lock()
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=20.0,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+    return _client
+
+async def _get_token() -> str:
+    if not TENANT or not CLIENT_ID or not CLIENT_SECRET:
+        raise RuntimeError("Power BI not configured")
+    now = time.time()
+    if _token_cache["access_token"] and now < _token_cache["expires_at"] - 60:
+        return _token_cache["access_token"]
+    async with _token_lock:
+        # double-check: another task may have refreshed while we waited
+        now = time.time()
+        if _token_cache["access_token"] and now < _token_cache["expires_at"] - 60:
+            return _token_cache["access_token"]
+        r = await _get_client().post(_auth_url(), data={
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "client_credentials",
+            "scope": SCOPE,
+        })
+        r.raise_for_status()
+        tok = r.json()
+        _token_cache.update({
+            "access_token": tok["access_token"],
+            "expires_at": now + int(tok.get("expires_in", 3599)),
+        })
+        return _token_cache["access_token"]
+
+async def push_rows(rows) -> bool:
+    token = await _get_token()
+    url = f"https://api.powerbi.com/v1.0/myorg/groups/{GROUP_ID}/datasets/{DATASET_ID}/tables/{TABLE}/rows"
+    hdrs = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    r = await _get_client().post(url, headers=hdrs, content=orjson.dumps({"rows": rows}))
+    r.raise_for_status()
+    return True
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
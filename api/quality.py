@@ -1,15 +1,30 @@
 # api/quality.py
-import json
 from typing import List, Dict, Any
+
+import orjson
+
 from api.chains import get_llm
 
+# Frozen system message: an identical prompt prefix across calls lets the
+# backend's prompt caching kick in.
+_JUDGE_SYS = {
+    "role": "system",
+    "content": (
+        "You are a strict policy auditor. Score groundedness 0..1 ONLY from provided snippets. "
+        "Return JSON: {\"grounding_score\": float, \"issues\": [string]}. No extra text."
+    ),
+}
+
 def judge_answer(answer: str, snippets: List[str]) -> Dict[str, Any]:
     llm = get_llm()
-    sys = ("You are a strict policy auditor. Score groundedness 0..1 ONLY from provided snippets. "
-           "Return JSON: {\"grounding_score\": float, \"issues\": [string]}. No extra text.")
     user = f"Answer:\n{answer}\n\nSnippets:\n" + "\n---\n".join(snippets)
-    out = llm.invoke([{"role":"system","content":sys},{"role":"user","content":user}])
+    # JSON mode makes the model's output guaranteed-parseable, so the fallback
+    # below only fires for backends without it (e.g. the offline MockLLM).
+    out = llm.invoke(
+        [_JUDGE_SYS, {"role": "user", "content": user}],
+        response_format={"type": "json_object"},
+    )
     try:
-        return json.loads(getattr(out, 'content', str(out)))
-    except Exception:
+        return orjson.loads(getattr(out, 'content', str(out)))
+    except orjson.JSONDecodeError:
         return {"grounding_score": 0.6, "issues": ["Non-JSON judge output"]}
@@ -0,0 +1,89 @@
+# api/semcache.py
+# In-process semantic cache in front of /ask. Near-duplicate questions are the
+# norm in helpdesk traffic; a hit returns the cached response payload and skips
+# the vector search and both LLM calls entirely. Brute-force cosine over a few
+# thousand normalized vectors is a single small matmul — no index library
+# needed at this scale.
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# NumPy is required for the vector math; without it the cache is a no-op.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Cosine similarity needed to treat two questions as the same. 0.95 is
+# conservative; lower it once hit metadata (hits/last_score) shows headroom.
+THRESHOLD = float(os.getenv("SEMCACHE_THRESHOLD", "0.95"))
+MAX_ENTRIES = int(os.getenv("SEMCACHE_MAX", "2048"))
+
+_lock = threading.Lock()
+_entries: List[Dict[str, Any]] = []   # {"grade", "payload", "hits", "last_score", "ts"}
+_vecs: List["np.ndarray"] = []        # normalized float32, parallel to _entries
+_matrix = None                        # stacked (N, D) view, rebuilt lazily
+
+
+def enabled() -> bool:
+    return np is not None
+
+
+def _normalize(vec) -> "np.ndarray":
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+def _ensure_matrix():
+    global _matrix
+    if _matrix is None and _vecs:
+        _matrix = np.vstack(_vecs)
+    return _matrix
+
+
+def lookup(vec, grade: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Return the cached response payload for the nearest cached question of the
+    same grade, or None. Grade is part of the key: answers are filtered by
+    visibility, so a hit for one grade must never serve another.
+    """
+    if np is None or not _entries:
+        return None
+    with _lock:
+        m = _ensure_matrix()
+        if m is None:
+            return None
+        scores = m @ _normalize(vec)
+        best_i, best = -1, THRESHOLD
+        for i, e in enumerate(_entries):
+            if e["grade"] == grade and scores[i] >= best:
+                best_i, best = i, float(scores[i])
+        if best_i < 0:
+            return None
+        e = _entries[best_i]
+        # Hit metadata kept so the threshold can be tuned from real traffic.
+        e["hits"] += 1
+        e["last_score"] = best
+        return e["payload"]
+
+
+def store(vec, grade: Optional[str], payload: Dict[str, Any]) -> None:
+    """Append a (vector, grade, payload) entry; oldest entries are evicted."""
+    if np is None:
+        return
+    global _matrix
+    with _lock:
+        if len(_entries) >= MAX_ENTRIES:
+            _entries.pop(0)
+            _vecs.pop(0)
+        _entries.append({
+            "grade": grade,
+            "payload": payload,
+            "hits": 0,
+            "last_score": None,
+            "ts": time.time(),
+        })
+        _vecs.append(_normalize(vec))
+        _matrix = None  # rebuilt on next lookup
@@ -0,0 +1,77 @@
+# api/telemetry_queue.py
+# Batches telemetry rows across requests. Each suspicious /ask used to fire
+# its own single-row POST; an anomaly storm meant a storm of HTTP calls. Rows
+# now land on an asyncio.Queue and one consumer drains them in windows of up
+# to BATCH_MAX rows / BATCH_WINDOW seconds, forwarding a single POST per
+# batch through the shared async client.
+import asyncio
+import os
+from typing import Any, Callable, Dict, Optional
+
+BATCH_MAX = int(os.getenv("TELEMETRY_BATCH_MAX", "50"))
+BATCH_WINDOW = float(os.getenv("TELEMETRY_BATCH_WINDOW", "0.2"))
+
+_queue: Optional[asyncio.Queue] = None
+_task: Optional[asyncio.Task] = None
+_sink: Optional[Callable] = None  # async callable taking list[dict]
+
+
+def start(sink) -> None:
+    """Create the queue and consumer task; call from a startup handler."""
+    global _queue, _task, _sink
+    if _task is not None:
+        return
+    _sink = sink
+    _queue = asyncio.Queue(maxsize=10_000)
+    _task = asyncio.get_event_loop().create_task(_consume())
+
+
+def enqueue(row: Dict[str, Any]) -> bool:
+    """
+    Non-blocking enqueue from the request path. Returns False when the queue
+    is not running or full so the caller can fall back to a direct push;
+    telemetry is best-effort either way.
+    """
+    if _queue is None:
+        return False
+    try:
+        _queue.put_nowait(row)
+        return True
+    except asyncio.QueueFull:
+        return False
+
+
+async def _consume() -> None:
+    while True:
+        rows = [await _queue.get()]
+        # Coalesce whatever arrives inside the window, up to the batch cap.
+        while len(rows) < BATCH_MAX:
+            try:
+                rows.append(await asyncio.wait_for(_queue.get(), timeout=BATCH_WINDOW))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await _sink(rows)
+        except Exception:
+            pass  # never let the sink kill the consumer
+
+
+async def stop() -> None:
+    """Cancel the consumer and flush anything still queued; call on shutdown."""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+    rows = []
+    while _queue is not None and not _queue.empty():
+        rows.append(_queue.get_nowait())
+    if rows:
+        try:
+            await _sink(rows)
+        except Exception:
+            pass
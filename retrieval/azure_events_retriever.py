@@ -1,8 +1,11 @@
 # retrieval/azure_events_retriever.py
+import functools
 import os
-from typing import List, Optional, Tuple, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple, Dict, Any
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
+from retrieval.search_client import RETRY_KWARGS, shared_transport
 
 # Required env
 EVENTS_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
@@ -20,68 +23,69 @@ _client = SearchClient(
     endpoint=EVENTS_ENDPOINT,
     index_name=EVENTS_INDEX,
     credential=AzureKeyCredential(EVENTS_KEY),
+    transport=shared_transport(),
+    **RETRY_KWARGS,
 )
 
-def get_events_by_ids(ids: List[str]) -> List[Dict[str, Any]]:
+class EventHit(NamedTuple):
+    """
+    One log event as a fixed-slot record, mirroring retrieval's Chunk: no
+    per-row dict with repeated string keys, and consumers read fields via
+    C-level attribute access instead of hashed key lookups.
+    """
+    event_id: Optional[str]
+    timestamp: Optional[str]
+    action: Optional[str]
+    status: Optional[str]
+    user_role: Optional[str]
+    system: Optional[str]
+    location: Optional[str]
+
+def _row(d) -> EventHit:
+    return EventHit(
+        event_id=_sel(d, "event_id"),
+        timestamp=_sel(d, "timestamp"),
+        action=_sel(d, "action"),
+        status=_sel(d, "status"),
+        user_role=_sel(d, "user_role"),
+        system=_sel(d, "system"),
+        location=_sel(d, "location"),
+    )
+
+def get_events_by_ids(ids: List[str]) -> List[EventHit]:
     if not ids:
         return []
 
-    out: List[Dict[str, Any]] = []
+    select_fields = ["event_id", "timestamp", "action", "status", "user_role", "system", "location"]
 
-    # 1) Fast path: try get_document per id (best when ids count is modest)
+    # 1) Primary path: one search.in filter fetches every id in a single
+    #    round trip instead of N sequential get_document calls.
     try:
-        for eid in ids:
-            try:
-                d = _evt_client.get_document(key=eid)
-                out.append({
-                    "event_id": d.get("event_id"),
-                    "timestamp": d.get("timestamp"),
-                    "action": d.get("action"),
-                    "status": d.get("status"),
-                    "user_role": d.get("user_role"),
-                    "system": d.get("system"),
-                    "location": d.get("location"),
-                })
-            except Exception:
-                # If a particular ID is missing, just skip it
-                pass
+        id_list = ",".join(x.replace("'", "''") for x in ids)
+        results = _client.search(
+            search_text="*",
+            filter=f"search.in(event_id, '{id_list}', ',')",
+            query_type="simple",
+            top=len(ids),
+            select=select_fields,
+        )
+        out = [_row(r) for r in results]
         if out:
             return out
     except Exception:
-        # If the service/SDK version doesn’t support get_document, fall back to filter
+        # e.g. service tier without search.in support — fall through
         pass
 
-    # 2) Fallback: OR-filter in small batches
-    def _fetch_batch(batch: list[str]) -> list[dict]:
-        if not batch:
-            return []
-        # Escape single quotes for OData literal strings
-        parts = ["event_id eq '{}'".format(x.replace("'", "''")) for x in batch]
-        flt = " or ".join(parts)
-    
-        results = _evt_client.search(
-            search_text="*",
-            filter=flt,
-            query_type="simple",
-            top=len(batch),
-            select=["event_id","timestamp","action","status","user_role","system","location"],
-        )
-    
-        out = []
-        for r in results:
-            # r is a SearchResult; .get works if it’s dict-like, else use getattr fallback
-            get = r.get if hasattr(r, "get") else lambda k, d=None: getattr(r, k, d)
-            out.append({
-                "event_id":  get("event_id"),
-                "timestamp": get("timestamp"),
-                "action":    get("action"),
-                "status":    get("status"),
-                "user_role": get("user_role"),
-                "system":    get("system"),
-                "location":  get("location"),
-            })
-        return out
+    # 2) Fallback: per-id lookups, fanned out so N ids cost ~1 RTT of wall
+    #    time instead of N. Missing ids are skipped as before.
+    def _fetch_one(eid: str) -> Optional[EventHit]:
+        try:
+            return _row(_client.get_document(key=eid))
+        except Exception:
+            return None
 
+    with ThreadPoolExecutor(max_workers=min(32, len(ids))) as ex:
+        return [d for d in ex.map(_fetch_one, ids) if d is not None]
 
 def _sel(d, k, default=None):
     """Safe getter for Azure Search result (SearchResult acts like dict/object)."""
@@ -91,6 +95,7 @@ def _sel(d, k, default=None):
         # support dotted fields if needed in future (not used here)
         return getattr(d, k, default)
 
+@functools.lru_cache(maxsize=512)
 def _build_time_filter(time_min: Optional[str], time_max: Optional[str]) -> Optional[str]:
     parts = []
     if time_min:
@@ -100,10 +105,17 @@ def _build_time_filter(time_min: Optional[str], time_max: Optional[str]) -> Opti
     return " and ".join(parts) if parts else None
 
 # --- Vector helpers (optional) ---
+# Exact-hit cache: repeated event queries skip the embeddings round trip.
+_EMBED_CACHE: Dict[str, List[float]] = {}
+_EMBED_CACHE_MAX = 2048
+
 def _embed_query(q: str) -> Optional[List[float]]:
     """Return embedding vector for q using Azure OpenAI if configured; else None."""
     if not (USE_EVENTS_VECTOR and AOAI_ENDPOINT and AOAI_KEY and AOAI_EMBED_DEPLOY):
         return None
+    vec = _EMBED_CACHE.get(q)
+    if vec is not None:
+        return vec
     try:
         from openai import AzureOpenAI
         client = AzureOpenAI(
@@ -116,7 +128,11 @@ def _embed_query(q: str) -> Optional[List[float]]:
             model=AOAI_EMBED_DEPLOY,    # deployment name
             input=q or "",
         )
-        return resp.data[0].embedding
+        vec = resp.data[0].embedding
+        if len(_EMBED_CACHE) >= _EMBED_CACHE_MAX:
+            _EMBED_CACHE.clear()
+        _EMBED_CACHE[q] = vec
+        return vec
     except Exception:
         return None
 
@@ -139,11 +155,19 @@ def search_events(
     time_min: Optional[str],
     time_max: Optional[str],
     top: int = 50,
-) -> List[dict]:
+    order_by_time: bool = True,
+) -> List[EventHit]:
     """
     Matches your aegisai-logs-indx fields:
       event_id (key), timestamp (DateTimeOffset), action, user_role, system, location, status
     Also supports hybrid (keyword + vector on log_vector) if EVENTS_USE_VECTOR=true.
+
+    order_by_time=False skips the explicit $orderby: that lets the service
+    use its ranking fast path (an $orderby sorts the whole candidate set
+    before top is applied) and returns relevance (@search.score) order.
+    Only do that for real term queries — with the wildcard default every
+    document scores the same and top would truncate arbitrarily, so strict
+    timestamp-desc stays the default.
     """
     flt = _build_time_filter(time_min, time_max)
 
@@ -170,22 +194,12 @@ def search_events(
         search_text=search_text,
         filter=flt,
         top=top,
-        order_by=["timestamp desc"],
+        order_by=["timestamp desc"] if order_by_time else None,
         select=select_fields,
         query_type="simple",
         vector_queries=vector_queries,  # None if vector disabled/unavailable
     )
 
-    out: List[dict] = []
-    for r in results:
-        out.append({
-            "event_id":  _sel(r, "event_id"),
-            "timestamp": _sel(r, "timestamp"),
-            "action":    _sel(r, "action"),
-            "status":    _sel(r, "status"),
-            "user_role": _sel(r, "user_role"),
-            "system":    _sel(r, "system"),
-            "location":  _sel(r, "location"),
-            # risk_context not present in your index—left out intentionally
-        })
-    return out
+    # risk_context is not present in this index — EventHit intentionally
+    # carries only the selected fields.
+    return [_row(r) for r in results]
@@ -1,10 +1,24 @@
+import asyncio
+import functools
 import os
+import queue
+import threading
+import time
+from concurrent import futures as cfutures
 from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.models import VectorizedQuery
 from azure.core.exceptions import HttpResponseError
-from openai import AzureOpenAI
-from typing import Tuple, List, Dict
+from retrieval.search_client import RETRY_KWARGS, shared_transport
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from typing import NamedTuple, Optional, Tuple, List, Dict
+
+# Native async Search client; needs the aiohttp transport. Fall back to
+# threadpool-wrapped sync calls when it is unavailable.
+try:
+    from azure.search.documents.aio import SearchClient as AsyncSearchClient
+except ImportError:
+    AsyncSearchClient = None
 
 ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
 INDEX    = os.getenv("AZURE_SEARCH_INDEX")
@@ -13,8 +27,49 @@ KEY      = os.getenv("AZURE_SEARCH_API_KEY")
 if not all([ENDPOINT, INDEX, KEY]):
     raise RuntimeError("Azure Search is not configured: set AZURE_SEARCH_ENDPOINT, AZURE_SEARCH_INDEX, AZURE_SEARCH_API_KEY")
     
-_client = SearchClient(endpoint=ENDPOINT, index_name=INDEX, credential=AzureKeyCredential(KEY))
+_client = SearchClient(
+    endpoint=ENDPOINT,
+    index_name=INDEX,
+    credential=AzureKeyCredential(KEY),
+    transport=shared_transport(),
+    **RETRY_KWARGS,
+)
+_aclient = (
+    AsyncSearchClient(endpoint=ENDPOINT, index_name=INDEX, credential=AzureKeyCredential(KEY), **RETRY_KWARGS)
+    if AsyncSearchClient is not None else None
+)
 _aoai_client = None
+_aoai_aclient = None
+
+class Chunk(NamedTuple):
+    """
+    One retrieved policy clause as a fixed-slot record.
+
+    /ask reads each chunk's fields many times (context build, citations,
+    highlights, judge snippets); attribute access on a namedtuple is a C-level
+    lookup instead of a dict hash+probe per read, and the fixed layout keeps
+    the field mapping (policy_title -> title) at the retrieval boundary.
+    """
+    policy_id: str
+    clause_id: str
+    title: Optional[str]
+    section: Optional[str]
+    clause_text: Optional[str]
+    visibility: Optional[str]
+    allowed_grades: list
+    department: Optional[str]
+
+def _chunk_from_result(r) -> Chunk:
+    return Chunk(
+        policy_id=_doc_get(r, "policy_id"),
+        clause_id=_doc_get(r, "clause_id"),
+        title=_doc_get(r, "policy_title"),   # mapped
+        section=_doc_get(r, "section"),
+        clause_text=_doc_get(r, "clause_text"),
+        visibility=_doc_get(r, "visibility"),
+        allowed_grades=_doc_get(r, "allowed_grades") or [],
+        department=_doc_get(r, "department"),
+    )
 
 # ---- Add to retrieval/azure_retriever.py -----------------------------------
 from typing import Tuple, List, Dict
@@ -53,11 +108,32 @@ def _get_aoai():
         )
     return _aoai_client
 
+# Async embeddings twin, lazily built like the sync one
+def _get_aoai_async():
+    global _aoai_aclient
+    if _aoai_aclient is None:
+        _aoai_aclient = AsyncAzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        )
+    return _aoai_aclient
+
 _EMBED_DEPLOY = os.getenv("AZURE_OPENAI_EMBED_DEPLOYMENT")  # e.g., textemb3 (1536 dims)
 
+# Every field /ask actually renders (context, citations, highlights) and
+# nothing more — response size tracks the select list, so unused fields like
+# department stay out of the payload. Access control itself lives in the
+# OData filter, not in returned fields.
+_SELECT_FULL = [
+    "policy_id", "clause_id", "clause_text", "section",
+    "visibility", "allowed_grades", "policy_title",
+]
+
 def _normalize_grade(g: str) -> str:
     return (g or "").strip()
 
+@functools.lru_cache(maxsize=64)
 def _policy_filter_for_grade(g: str) -> str:
     """
     visibility != 'restricted'  → allowed (no grade check)
@@ -76,21 +152,117 @@ def _doc_get(d, k, default=None):
     except Exception:
         return getattr(d, k, default)
 
+# Exact-hit embedding cache shared by the sync and async paths: query texts
+# repeat heavily and identical text always embeds to the identical vector,
+# so repeats cost a dict lookup instead of an API round trip. Callers treat
+# the returned vector as read-only.
+_EMBED_CACHE: Dict[str, list] = {}
+_EMBED_CACHE_MAX = 4096
+
+def _embed_cache_put(text: str, vec: list) -> list:
+    if len(_EMBED_CACHE) >= _EMBED_CACHE_MAX:
+        _EMBED_CACHE.clear()
+    _EMBED_CACHE[text] = vec
+    return vec
+
+class _EmbedBatcher:
+    """
+    Coalesces concurrent embedding requests into one API call.
+
+    The embeddings endpoint accepts a list input, so N in-flight queries can
+    ride a single round-trip instead of N. Callers submit text and get a
+    Future; a daemon worker drains the queue, lingering LINGER seconds after
+    the first item to let a burst accumulate (bounded by MAX_BATCH), then
+    issues one embeddings.create and resolves every future. A lone caller
+    pays at most the linger on top of the API call.
+    """
+    LINGER = 0.01
+    MAX_BATCH = 256
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> "cfutures.Future":
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    t = threading.Thread(target=self._worker, daemon=True)
+                    t.start()
+                    self._started = True
+        fut: "cfutures.Future" = cfutures.Future()
+        self._queue.put((text, fut))
+        return fut
+
+    def _worker(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.LINGER
+            while len(batch) < self.MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Duplicate texts inside one batch embed once, resolve everywhere.
+            by_text: Dict[str, list] = {}
+            for text, fut in batch:
+                by_text.setdefault(text, []).append(fut)
+            texts = list(by_text)
+            try:
+                out = _get_aoai().embeddings.create(model=_EMBED_DEPLOY, input=texts)
+                vecs = [d.embedding for d in sorted(out.data, key=lambda d: d.index)]
+                for text, vec in zip(texts, vecs):
+                    _embed_cache_put(text, vec)
+                    for fut in by_text[text]:
+                        fut.set_result(vec)
+            except Exception as e:
+                for futs in by_text.values():
+                    for fut in futs:
+                        fut.set_exception(e)
+
+_embed_batcher = _EmbedBatcher()
+
 def _embed_query(text: str) -> list[float]:
-    _aoai = _get_aoai()
-    out = _aoai.embeddings.create(model=_EMBED_DEPLOY, input=text)
-    return out.data[0].embedding
+    vec = _EMBED_CACHE.get(text)
+    if vec is not None:
+        return vec
+    return _embed_batcher.submit(text).result()
 
-def get_chunks_vector(query: str, user_grade: str, top: int = 5, k: int = 20, hybrid: bool = True):
+def embed_query(text: str) -> list[float]:
+    """Public embedder, shared with the semantic cache so callers that already
+    hold the query vector can pass it back in via get_chunks_vector(qvec=...)."""
+    return _embed_query(text)
+
+def embed_batch(texts: List[str]) -> List[list]:
+    """
+    Embed several texts in one API call. The embeddings endpoint accepts a
+    list input, so N texts cost one HTTP round-trip instead of N — use this
+    anywhere query + clause embeddings are needed together (e.g. an
+    embedding-based grounding score).
+    """
+    if not texts:
+        return []
+    out = _get_aoai().embeddings.create(model=_EMBED_DEPLOY, input=texts)
+    # API may return items out of order; restore input order via index.
+    return [d.embedding for d in sorted(out.data, key=lambda d: d.index)]
+
+def get_chunks_vector(query: str, user_grade: str, top: int = 5, k: int = 20, hybrid: bool = True, qvec: Optional[list] = None):
     """
     Vector or hybrid (text + vector) retrieval using 'embedding' field.
     - top: final number of docs returned to caller
     - k: neighbors to pull from vector stage before optional hybrid re-rank on server
+    - qvec: precomputed query embedding; avoids a second embeddings call when
+      the caller already embedded the query (e.g. for the semantic cache)
     """
     g = _normalize_grade(user_grade)
     flt = _policy_filter_for_grade(g)
 
-    qvec = _embed_query(query)
+    if qvec is None:
+        qvec = _embed_query(query)
     vq = VectorizedQuery(vector=qvec, k_nearest_neighbors=k, fields="content_vector")
 
     try:
@@ -102,10 +274,7 @@ def get_chunks_vector(query: str, user_grade: str, top: int = 5, k: int = 20, hy
                 filter=flt,
                 query_type="simple",
                 top=top,
-                select=[
-                    "policy_id","clause_id","clause_text","section",
-                    "visibility","allowed_grades","department","policy_title"
-                ],
+                select=_SELECT_FULL,
             )
         else:
             # VECTOR-ONLY
@@ -114,32 +283,100 @@ def get_chunks_vector(query: str, user_grade: str, top: int = 5, k: int = 20, hy
                 vector_queries=[vq],
                 filter=flt,
                 top=top,
-                select=[
-                    "policy_id","clause_id","clause_text","section",
-                    "visibility","allowed_grades","department","policy_title"
-                ],
+                select=_SELECT_FULL,
             )
 
-        out = []
-        for r in results:
-            out.append({
-                "policy_id":       _doc_get(r, "policy_id"),
-                "clause_id":       _doc_get(r, "clause_id"),
-                "title":           _doc_get(r, "policy_title"),
-                "section":         _doc_get(r, "section"),
-                "clause_text":     _doc_get(r, "clause_text"),
-                "visibility":      _doc_get(r, "visibility"),
-                "allowed_grades":  _doc_get(r, "allowed_grades") or [],
-                "department":      _doc_get(r, "department"),
-                # Optional: include scores
-                # "score":           _doc_get(r, "@search.score")
-            })
-        return out
+        return [_chunk_from_result(r) for r in results]
 
     except HttpResponseError as e:
         # Bubble up for clearer error in /ask
         raise
 
+# ---- Async variants --------------------------------------------------------
+# Native aio SearchClient when the aiohttp transport is installed: requests
+# run on the event loop with no threadpool hop. Otherwise the sync calls are
+# pushed onto the default executor so async routes can still gather them.
+async def embed_query_async(text: str) -> list[float]:
+    vec = _EMBED_CACHE.get(text)
+    if vec is not None:
+        return vec
+    # Route through the batcher so concurrent async and sync embeds share
+    # one API call; wrap_future bridges its concurrent.futures result.
+    return await asyncio.wrap_future(_embed_batcher.submit(text))
+
+
+async def get_chunks_vector_async(query: str, user_grade: str, top: int = 5, k: int = 20, hybrid: bool = True, qvec: Optional[list] = None):
+    if _aclient is None:
+        return await asyncio.to_thread(get_chunks_vector, query, user_grade, top, k, hybrid, qvec)
+    g = _normalize_grade(user_grade)
+    flt = _policy_filter_for_grade(g)
+    if qvec is None:
+        qvec = await embed_query_async(query)
+    vq = VectorizedQuery(vector=qvec, k_nearest_neighbors=k, fields="content_vector")
+    results = await _aclient.search(
+        search_text=query if hybrid else None,
+        vector_queries=[vq],
+        filter=flt,
+        query_type="simple",
+        top=top,
+        select=_SELECT_FULL,
+    )
+    return [_chunk_from_result(r) async for r in results]
+
+async def get_chunks_async(query: str, user_grade: str, top: int = 5):
+    if _aclient is None:
+        return await asyncio.to_thread(get_chunks, query, user_grade, top)
+    g = _normalize_grade(user_grade)
+    flt = _policy_filter_for_grade(g)
+    results = await _aclient.search(
+        search_text=query,
+        filter=flt,
+        query_type="simple",
+        top=top,
+        select=_SELECT_FULL,
+    )
+    return [_chunk_from_result(r) async for r in results]
+
+async def count_restricted_hits_async(query: str, top: int = 5) -> Tuple[int, List[Dict]]:
+    if _aclient is None:
+        return await asyncio.to_thread(count_restricted_hits, query, top)
+    results = await _aclient.search(
+        search_text=query,
+        filter="visibility eq 'restricted'",
+        query_type="simple",
+        top=top,
+        select=["policy_id", "clause_id", "policy_title", "section", "visibility"],
+    )
+    hits = [
+        {
+            "policy_id": _doc_get(r, "policy_id"),
+            "clause_id": _doc_get(r, "clause_id"),
+            "title": _doc_get(r, "policy_title"),
+            "section": _doc_get(r, "section"),
+            "visibility": _doc_get(r, "visibility"),
+        }
+        async for r in results
+    ]
+    return len(hits), hits
+
+# Bound for batched retrieval bursts; keeps us inside the SDK's connection
+# pool instead of stampeding the service.
+_BATCH_CONCURRENCY = 8
+
+async def get_chunks_batch(queries: List[Tuple[str, str]], top: int = 5) -> List[List[Dict]]:
+    """
+    Run several (query, grade) keyword retrievals as one bounded concurrent
+    burst. N serial round-trips collapse to ~one RTT; results come back in
+    input order.
+    """
+    sem = asyncio.Semaphore(_BATCH_CONCURRENCY)
+
+    async def _one(q: str, g: str):
+        async with sem:
+            return await get_chunks_async(q, g, top)
+
+    return await asyncio.gather(*[_one(q, g) for q, g in queries])
+
 def get_chunks(query: str, user_grade: str, top: int = 5):
     g = _normalize_grade(user_grade)
     flt = _policy_filter_for_grade(g)
@@ -149,29 +386,8 @@ def get_chunks(query: str, user_grade: str, top: int = 5):
         filter=flt,
         query_type="simple",   # use 'semantic' only if you configured it on the index
         top=top,
-        select=[
-            "policy_id",
-            "clause_id",
-            "policy_title",
-            "section",
-            "clause_text",
-            "visibility",
-            "allowed_grades",
-            "department",
-        ],
+        select=_SELECT_FULL,
     )
 
-    chunks = []
-    for r in results:
-        # Map your index fields -> keys your ask() expects
-        chunks.append({
-            "policy_id":       _doc_get(r, "policy_id"),
-            "clause_id":       _doc_get(r, "clause_id"),
-            "title":           _doc_get(r, "policy_title"),  # mapped
-            "section":         _doc_get(r, "section"),
-            "clause_text":     _doc_get(r, "clause_text"),        # mapped
-            "visibility":      _doc_get(r, "visibility"),
-            "allowed_grades":  _doc_get(r, "allowed_grades") or [],
-            "department":      _doc_get(r, "department"),
-        })
-    return chunks
+    # Map your index fields -> the Chunk fields ask() expects
+    return [_chunk_from_result(r) for r in results]
@@ -1,33 +1,171 @@
-import json
-from pathlib import Path
-from typing import List, Dict, Optional
-
-# Simple keyword search over local policies.jsonl, with grade filtering
-def load_policies(path: str = "data/policies.jsonl") -> List[Dict]:
-    out = []
-    for ln in Path(path).read_text().splitlines():
-        if ln.strip(): out.append(json.loads(ln))
-    return out
-
-POLICIES = None
-
-def get_chunks(query: str, user_grade: Optional[str]) -> List[Dict]:
-    global POLICIES
-    POLICIES = POLICIES or load_policies()
-    q = query.lower()
-    # grade filter: public OR allowed_grades contains user_grade
-    def allowed(rec):
-        if rec.get("visibility", "public") == "public": return True
-        if not user_grade: return False
-        return user_grade in (rec.get("allowed_grades") or [])
-    # naive ranking by keyword hits
-    scored = []
-    for r in POLICIES:
-        if not allowed(r):
-            continue
-        text = (r.get("clause_text","" ) + " " + " ".join(r.get("tags",[]))).lower()
-        score = sum(1 for tok in q.split() if tok in text)
-        if score > 0: scored.append((score, r))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [r for _, r in scored[:5]]
-
+import collections
+import json
+import os
+import re
+from pathlib import Path
+from typing import Callable, List, Dict, Optional
+
+# NumPy powers the optional vector path; the keyword path works without it.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# C-accelerated JSON when available; line-oriented loads are 3-5x faster.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Simple keyword search over local policies.jsonl, with grade filtering
+def load_policies(path: str = "data/policies.jsonl") -> List[Dict]:
+    # Stream the file as bytes lines: peak memory is one line plus the parsed
+    # records, instead of the whole text held twice (string + splitlines list).
+    out = []
+    with open(path, "rb") as f:
+        for ln in f:
+            if ln.strip():
+                out.append(_json_loads(ln))
+    return out
+
+POLICIES = None
+
+# ---- Struct-of-Arrays views, built once at first query ---------------------
+# Parallel arrays over POLICIES so per-query scoring streams precomputed data
+# instead of re-lowercasing and re-joining strings from every record dict.
+_TEXTS: List[str] = []              # lowercased clause_text + tags, per record
+_PUBLIC: List[bool] = []            # visibility == public, per record
+_ALLOWED: List[frozenset] = []      # allowed_grades, per record
+_GRADE_MASKS: Dict[Optional[str], List[bool]] = {}  # grade -> allowed mask
+# Inverted index: token -> sorted record indices. Scoring a query walks only
+# the posting lists for its tokens instead of scanning every record's text.
+_INV: Dict[str, List[int]] = {}
+_WORD_RE = re.compile(r"\w+")
+
+# Optional dense path: a contiguous (N, D) float32 matrix of L2-normalized
+# chunk embeddings (same order as POLICIES), scored with one matmul per query.
+EMB_PATH = os.getenv("POLICY_EMB_PATH", "data/policies.npy")
+# int8 storage quarters the matrix's resident memory; scores are
+# reconstructed from per-row scales. The integer matmul takes NumPy's
+# non-BLAS path and is slower per query than the float32 product, so this
+# is opt-in for memory-constrained deployments, not a speed switch.
+EMB_INT8 = os.getenv("POLICY_EMB_INT8", "false").lower() == "true"
+_EMB = None          # float32 matrix (when quantization is off)
+_EMB_Q = None        # int8 matrix (when quantization is on)
+_SCALES = None       # per-row dequantization scales for _EMB_Q
+_embed_fn: Optional[Callable[[str], "np.ndarray"]] = None
+
+
+def register_embedder(fn: Callable[[str], "np.ndarray"]) -> None:
+    """Install a query embedder (text -> 1-D float vector) for the dense path."""
+    global _embed_fn
+    _embed_fn = fn
+
+
+def _ensure_loaded() -> None:
+    global POLICIES, _EMB
+    if POLICIES is not None:
+        return
+    POLICIES = load_policies()
+    for i, r in enumerate(POLICIES):
+        text = (r.get("clause_text", "") + " " + " ".join(r.get("tags", []))).lower()
+        _TEXTS.append(text)
+        _PUBLIC.append(r.get("visibility", "public") == "public")
+        _ALLOWED.append(frozenset(r.get("allowed_grades") or []))
+        for tok in set(_WORD_RE.findall(text)):
+            _INV.setdefault(tok, []).append(i)
+    if np is not None and os.path.exists(EMB_PATH):
+        emb = np.load(EMB_PATH).astype(np.float32, copy=False)
+        if emb.shape[0] == len(POLICIES):
+            norms = np.linalg.norm(emb, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            emb = np.ascontiguousarray(emb / norms)
+            if EMB_INT8:
+                global _EMB_Q, _SCALES
+                row_max = np.max(np.abs(emb), axis=1)
+                row_max[row_max == 0] = 1.0
+                _EMB_Q = np.round(emb / row_max[:, None] * 127.0).astype(np.int8)
+                _SCALES = (row_max / 127.0).astype(np.float32)
+            else:
+                _EMB = emb
+
+
+def _allowed_mask(user_grade: Optional[str]) -> List[bool]:
+    mask = _GRADE_MASKS.get(user_grade)
+    if mask is None:
+        if user_grade:
+            mask = [pub or user_grade in allowed for pub, allowed in zip(_PUBLIC, _ALLOWED)]
+        else:
+            mask = list(_PUBLIC)
+        _GRADE_MASKS[user_grade] = mask
+    return mask
+
+
+# RRF discount constant; 60 is the standard value from the original paper
+# and keeps a single top rank from dominating the fused score.
+_RRF_K = 60
+_FUSE_DEPTH = 50  # how deep each ranker contributes candidates to fusion
+
+
+def _keyword_rank(query: str, mask: List[bool], k: int) -> List[int]:
+    """Best-first record indices by distinct query-token hits. Walks only the
+    inverted-index posting lists for the query's tokens, so cost tracks
+    posting-list lengths rather than corpus size."""
+    counts = collections.Counter()
+    for tok in set(_WORD_RE.findall(query.lower())):
+        counts.update(_INV.get(tok, ()))
+    scored = sorted(
+        ((c, i) for i, c in counts.items() if mask[i]),
+        key=lambda x: (-x[0], x[1]),
+    )
+    return [i for _, i in scored[:k]]
+
+
+def _dense_rank(query: str, mask: List[bool], k: int) -> Optional[List[int]]:
+    """Best-first record indices by cosine score, or None when the dense path
+    (embeddings matrix + registered embedder) is not available."""
+    if (_EMB is None and _EMB_Q is None) or _embed_fn is None:
+        return None
+    q = np.asarray(_embed_fn(query), dtype=np.float32)
+    qn = np.linalg.norm(q)
+    if qn > 0:
+        q = q / qn
+    if _EMB_Q is not None:
+        # Symmetric int8 x int8 dot with per-row + query scales. dtype=int32
+        # makes matmul accumulate in int32 without materializing a widened
+        # copy of the whole matrix per query (127*127*dims stays well inside
+        # int32 range).
+        q_max = float(np.max(np.abs(q))) or 1.0
+        q_q = np.round(q / q_max * 127.0).astype(np.int8)
+        scores = np.matmul(_EMB_Q, q_q, dtype=np.int32).astype(np.float32) * (_SCALES * (q_max / 127.0))
+    else:
+        scores = _EMB @ q
+    scores = np.where(np.asarray(mask), scores, -np.inf)
+    k = min(k, scores.shape[0])
+    top_idx = np.argpartition(scores, -k)[-k:]
+    top_idx = top_idx[np.argsort(scores[top_idx])[::-1]]
+    return [int(i) for i in top_idx if scores[i] > -np.inf]
+
+
+def get_chunks(query: str, user_grade: Optional[str]) -> List[Dict]:
+    _ensure_loaded()
+    mask = _allowed_mask(user_grade)
+
+    kw = _keyword_rank(query, mask, _FUSE_DEPTH)
+    dense = _dense_rank(query, mask, _FUSE_DEPTH)
+
+    if dense is None:
+        return [POLICIES[i] for i in kw[:5]]
+    if not kw:
+        return [POLICIES[i] for i in dense[:5]]
+
+    # Reciprocal rank fusion: a record's fused score sums 1/(K + rank) over
+    # the rankings it appears in, so keyword and dense evidence reinforce
+    # each other without needing their raw scores on a common scale.
+    fused: Dict[int, float] = {}
+    for ranking in (kw, dense):
+        for rank, i in enumerate(ranking):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (_RRF_K + rank)
+    top = sorted(fused, key=lambda i: -fused[i])[:5]
+    return [POLICIES[i] for i in top]
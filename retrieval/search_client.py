@@ -0,0 +1,29 @@
+# Shared HTTP plumbing for the Azure Search clients.
+#
+# Both indexes live on the same service, so the two SearchClients share one
+# transport: connections opened for policy queries are reused for event
+# queries instead of each client paying its own TLS handshakes. The default
+# pool of 10 connections also caps concurrency under load; 64 keeps a burst
+# of parallel queries from queueing on the pool. Module-level clients are
+# never closed, so sharing the transport is safe here.
+from azure.core.pipeline.transport import RequestsTransport
+
+_transport = None
+
+# Retry transient 503s/timeouts inside the pipeline instead of surfacing
+# them to callers; short backoff keeps the worst case bounded.
+RETRY_KWARGS = {
+    "retry_total": 3,
+    "retry_backoff_factor": 0.3,
+}
+
+
+def shared_transport() -> RequestsTransport:
+    global _transport
+    if _transport is None:
+        _transport = RequestsTransport(
+            connection_timeout=5,
+            read_timeout=30,
+            connection_pool_maxsize=64,
+        )
+    return _transport
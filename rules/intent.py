@@ -15,10 +15,18 @@ RISKY_PATTERNS = [
     r"\badmin\b.*\b(escalate|privilege)\b",
 ]
 
+# Compile the whole bank into a single alternation at import time so each
+# query is scanned once instead of once per pattern. The named groups p<i>
+# map the winning alternative back to its source pattern.
+_COMBINED = re.compile(
+    "|".join(f"(?P<p{i}>{p})" for i, p in enumerate(RISKY_PATTERNS)),
+    re.IGNORECASE,
+)
+
 def match_risky_intent(q: str) -> str | None:
     if not q:
         return None
-    for pat in RISKY_PATTERNS:
-        if re.search(pat, q, flags=re.IGNORECASE):
-            return pat
+    m = _COMBINED.search(q)
+    if m and m.lastgroup:
+        return RISKY_PATTERNS[int(m.lastgroup[1:])]
     return None
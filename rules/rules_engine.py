@@ -4,6 +4,12 @@ import os, datetime
 from typing import Tuple
 import yaml
 
+# libyaml's C loader when available — same guarded alias as rules.engine
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 _RULES_PATH = os.environ.get("AEGIS_RULES_PATH", os.path.abspath("rules.yaml"))
 _RULES_YAML = ""  # in-memory cache
 
@@ -28,7 +34,7 @@ def get_rules_yaml() -> str:
 def validate_yaml_block(yaml_text: str) -> Tuple[bool, str]:
     """Lightweight schema sanity check; returns (ok, message)."""
     try:
-        data = yaml.safe_load(yaml_text)
+        data = yaml.load(yaml_text, Loader=_YamlLoader)
     except Exception as e:
         return False, f"Invalid YAML: {e}"
     if not isinstance(data, dict):